@@ -2,6 +2,66 @@ import os
 import pandas as pd
 import numpy as np
 import time
+from functools import partial
+from numpy.lib.stride_tricks import sliding_window_view
+from instrument import Profiler
+from excel_export import open_workbook, write_sheet
+from trace_cache import cached
+
+
+def movement_onsets(distance, quiet=5, lookahead=3, min_gap=5, first=60):
+    # Frames where the animal starts moving: a frame with some distance
+    # after at least quiet frames without any, and some distance over the
+    # lookahead frames from it, all within the recording. Of those, only
+    # the onsets past frame first and more than min_gap frames before the
+    # next onset are kept, so the last onset never is.
+    distance = np.asarray(distance, dtype='float64')
+    moving = distance != 0
+
+    # Run-length encoding of the still and moving frames, an onset being
+    # the start of a moving run after a long enough still one
+    starts = np.concatenate(([0], np.flatnonzero(moving[1:] != moving[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(distance)))
+    onsets = starts[1:][moving[starts[1:]] & (lengths[:-1] >= quiet)]
+
+    # Distance over the lookahead frames from every onset, as a convolution
+    onsets = onsets[onsets <= len(distance) - lookahead]
+    if len(onsets):
+        ahead = np.convolve(distance, np.ones(lookahead), mode='valid')
+        onsets = onsets[ahead[onsets] != 0]
+
+    # Keep the distinct movements, far enough from the next one
+    keep = (onsets[:-1] + min_gap < onsets[1:]) & (onsets[:-1] > first)
+    return onsets[:-1][keep]
+
+
+def peri_event_windows(values, onsets, pre=5, post=5, keep_edges=False, baseline=False):
+    # The values from pre frames before to post frames after every onset,
+    # as an events x (pre + post + 1) matrix picked from a strided view of
+    # the values padded with NaN. Events whose window runs past either end
+    # of the recording are dropped, or kept with NaN for the missing
+    # frames with keep_edges. With baseline, the mean of the frames before
+    # the onset is taken off every window. Returns the onsets kept and
+    # their windows.
+    values = np.asarray(values, dtype='float64')
+    onsets = np.asarray(onsets, dtype=np.int64)
+    if not keep_edges:
+        onsets = onsets[(onsets >= pre) & (onsets + post < len(values))]
+    padded = np.concatenate((np.full(pre, np.nan), values, np.full(post, np.nan)))
+    windows = sliding_window_view(padded, pre + post + 1)[onsets]
+    if baseline and pre > 0:
+        windows = windows - np.nanmean(windows[:, :pre], axis=1, keepdims=True)
+    return onsets, windows
+
+
+def event_mean_sem(windows):
+    # Mean and standard error of the mean over the events of every frame of
+    # the windows, skipping NaN; NaN where there are too few events
+    count = np.sum(~np.isnan(windows), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(windows, axis=0) / count
+        sem = np.sqrt(np.nansum((windows - mean) ** 2, axis=0) / (count - 1) / count)
+    return mean, sem
 
 # Start timer for execution time measurement
 start_time = time.time()
@@ -22,6 +82,30 @@ for filename in dir_list:
 Conditions = ["Sal", "IL-4"]
 # Define maximum time threshold (seconds)
 MaxTime = 3600
+# Also profile the run with cProfile into 'Dopamine profile.prof'
+ProfileRun = False
+# Movement onsets: still frames before an onset, frames after it that must show movement,
+# frames to the next onset and first frame an onset can be at
+QuietFrames = 5
+LookaheadFrames = 3
+MinGap = 5
+FirstFrame = 60
+# Frames of dF/F kept before and after every onset, whether events too close to either end of the
+# recording are kept with blanks, and whether the mean of the frames before each onset is taken off
+PreFrames = 5
+PostFrames = 5
+KeepEdges = False
+Baseline = False
+# Stream the workbook to disk row by row, with filters instead of tables
+ConstantMemory = False
+# Keep the columns read from every workbook as .npy files in this directory (e.g. directory + '\\cache'),
+# so later runs skip reading the Excel files; None to always read them
+CacheDirectory = None
+# Bytes kept in the cache, the least recently used recordings go first
+CacheSize = 1 << 30
+
+# Time, memory and rows of every stage and file, written to 'Dopamine timings.json'
+profiler = Profiler(os.path.join(directory, "Dopamine profile.prof") if ProfileRun else None)
 
 # Initialize list to store dopamine data for each animal
 final = []
@@ -29,127 +113,69 @@ final = []
 # Loop through each file in the directory
 for filename in dir_list:
     if filename.endswith('.xlsx') and filename != "Dopamine Curves.xlsx":
+        with profiler.stage("curves", filename) as record:
 
-        # Temporary lists to store movement and dopamine data
-        mov = []
-        mov_parsed = []
-        dop = []
-        counter = 0
-
-        # Read the specific columns from each Excel file
-        df = pd.read_excel(directory + '\\' + filename, "dF_F Aligned", usecols="B:D")
-
-        # Detect movement by checking for non-zero values in the "Distance" column
-        for idx, i in df["Distance"].items():
-            if i != 0 and counter >= 5:
-                try:
-                    # If the next few rows have non-zero distances, add this index to movement
-                    if df._get_value(idx, 'Distance') + df._get_value(idx + 1, 'Distance') + df._get_value(idx + 2,
-                                                                                                           'Distance') != 0:
-                        mov.append(idx)
-                    counter = 0
-                except:
-                    counter = 0
-            elif i != 0 and counter < 5:
-                counter = 0
-            elif i == 0:
-                counter += 1
-
-        # Filter out close movements to capture distinct movement events
-        for i in range(0, len(mov) - 1):
-            if mov[i] + 5 < mov[i + 1] and mov[i] > 60:
-                mov_parsed.append(mov[i])
-
-        # Collect dopamine data in a +/-5 frame window around each movement
-        for loc in mov_parsed:
-            temp = [loc]
-            for i in range(-5, 6):
-                temp.append(df._get_value(loc + i, 'dF/F'))
-            dop.append(temp)
-
-        # Append dopamine data for each animal to final list
-        final.append(dop)
-
-# Initialize lists to store average dopamine values
-averages = [Animals]
-temp = []
-
-# Calculate average dopamine levels for each movement event
-for i in range(len(final)):
-    for a in final[i]:
-        temp.append(sum(a[1:]) / len(a[1:]))  # Average dopamine value around each movement event
-    averages.append(temp)
-    temp = []
+            # Read the specific columns from each Excel file, or from the cache if read before
+            df = cached(partial(pd.read_excel, sheet_name="dF_F Aligned", usecols="B:D"), directory + '\\' + filename,
+                        CacheDirectory, "dF_F Aligned B:D", CacheSize)
+            record["rows"] = df.shape[0]
+
+            # Detect distinct movements from the non-zero values in the "Distance" column
+            mov_parsed = movement_onsets(df["Distance"].to_numpy(), QuietFrames, LookaheadFrames, MinGap, FirstFrame)
+
+            # Collect dopamine data in a window of frames around each movement, an event per row
+            final.append(peri_event_windows(df["dF/F"].to_numpy(), mov_parsed, PreFrames, PostFrames, KeepEdges,
+                                            Baseline))
 
 # Create Excel file to store dopamine data
-writer = pd.ExcelWriter(directory + '\\' + "Dopamine Curves.xlsx", engine="xlsxwriter")
-df2 = pd.DataFrame()
-
-# Save each animal's dopamine data to a separate sheet in the Excel file
-for i in range(len(final)):
-    df = pd.DataFrame(final[i])
-    df = df.transpose()
-    df.columns = [str(round(x, 0)) for x in df.iloc[0]]
-    df = df.drop(0)
-    df2[Animals[i]] = df.mean(axis=1)  # Add animal averages to final dataframe
-
-    # Write data to Excel
-    df.to_excel(writer, sheet_name=Animals[i], startrow=1, header=False, index=False)
-
-    # Format Excel sheet
-    workbook = writer.book
-    worksheet = writer.sheets[Animals[i]]
-    (max_row, max_col) = df.shape
-    column_settings = [{"header": column} for column in df.columns]
-    worksheet.add_table(0, 0, max_row, max_col - 1, {"columns": column_settings})
-    cell_format = workbook.add_format({'align': 'center'})
-    cell_format.set_num_format(2)
-    worksheet.set_column(0, max_col - 1, 0, cell_format)
-    worksheet.autofit()
-
-# Organize final averages data by conditions
-df = df2
-df.columns = Animals
-AnimalsOrder = []
-
-# Group animals by conditions and reorder columns accordingly
-for cond in range(len(Conditions)):
-    globals()[f'Cond{cond}'] = 0
-    for animal in range(len(Animals)):
-        if Conditions[abs(cond - len(Conditions)) - 1] in Animals[abs(animal - len(Animals)) - 1]:
-            AnimalsOrder.insert(0, Animals[abs(animal - len(Animals)) - 1])
-            globals()[f'Cond{cond}'] += 1
-
-# Reorder the dataframe columns based on condition grouping
-df = df[AnimalsOrder]
-
-# Calculate padding to align columns by condition
-CondsNo = [globals()[f'Cond{cond}'] for cond in range(len(Conditions))]
-Max = max(CondsNo)
-CondsPad = [abs(CondsNo[i] - Max) for i in range(len(Conditions))]
-
-# Insert padding columns for alignment
-for (i, a) in zip(CondsPad, range(len(CondsPad))):
-    if i > 0:
-        for col in range(i):
-            df.insert(globals()[f'Cond{a}'], "", ['' for i in range(df.shape[0])], allow_duplicates=True)
-
-# Save final averages data to Excel
-df.to_excel(writer, sheet_name="Averages", startrow=1, header=False, index=False)
-workbook = writer.book
-worksheet = writer.sheets["Averages"]
-(max_row, max_col) = df.shape
-column_settings = [{"header": column} for column in df.columns]
-worksheet.add_table(0, 0, max_row, max_col - 1, {"columns": column_settings})
-cell_format = workbook.add_format({'align': 'center'})
-cell_format.set_num_format(2)
-worksheet.set_column(0, max_col - 1, 0, cell_format)
-worksheet.autofit()
-
-# Close the Excel writer
-writer.close()
+with profiler.stage("export"):
+    workbook = open_workbook(directory + '\\' + "Dopamine Curves.xlsx", ConstantMemory)
+    df2 = pd.DataFrame()
+    df3 = pd.DataFrame()
+
+    # Save each animal's dopamine data to a separate sheet in the Excel file, a column per movement
+    for i, (onsets, windows) in enumerate(final):
+        df = pd.DataFrame(windows.T, columns=[str(round(float(x), 0)) for x in onsets])
+        df2[Animals[i]], df3[Animals[i]] = event_mean_sem(windows)  # Add animal averages and SEM to final dataframes
+
+        # Write data to Excel
+        write_sheet(workbook, Animals[i], df)
+
+    # Organize final averages data by conditions
+    AnimalsOrder = []
+
+    # Group animals by conditions and reorder columns accordingly
+    for cond in range(len(Conditions)):
+        globals()[f'Cond{cond}'] = 0
+        for animal in range(len(Animals)):
+            if Conditions[abs(cond - len(Conditions)) - 1] in Animals[abs(animal - len(Animals)) - 1]:
+                AnimalsOrder.insert(0, Animals[abs(animal - len(Animals)) - 1])
+                globals()[f'Cond{cond}'] += 1
+
+    # Calculate padding to align columns by condition
+    CondsNo = [globals()[f'Cond{cond}'] for cond in range(len(Conditions))]
+    Max = max(CondsNo)
+    CondsPad = [abs(CondsNo[i] - Max) for i in range(len(Conditions))]
+
+    for name, df in (("Averages", df2), ("SEM", df3)):
+        # Reorder the dataframe columns based on condition grouping
+        df = df[AnimalsOrder]
+
+        # Insert padding columns for alignment
+        for (i, a) in zip(CondsPad, range(len(CondsPad))):
+            if i > 0:
+                for col in range(i):
+                    df.insert(globals()[f'Cond{a}'], "", ['' for i in range(df.shape[0])], allow_duplicates=True)
+
+        # Save final averages and their SEM to Excel
+        write_sheet(workbook, name, df)
+
+    # Close the Excel workbook
+    workbook.close()
 
 # Calculate and print execution time
 end_time = time.time()
 execution_time = end_time - start_time
 print("Execution time:", execution_time)
+profiler.write(os.path.join(directory, "Dopamine timings.json"))
+print(profiler.summary())
@@ -0,0 +1,415 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import makedirs, path
+import numpy as np
+import pandas as pd
+from instrument import Profiler, measured, timed
+from excel_export import open_workbook, write_sheet, write_workbook
+from trace_cache import CACHE_SIZE, cached, frame, lookup
+
+# seconds of every average
+PERIODS = [1, 5, 10, 60, 300, 600]
+# seconds of every recording kept
+MAX_TIME = 3600
+# averages of every animal of the cohort, one sheet per period
+COHORT = "Averages All.xlsx"
+# stage timings and cProfile stats, written to the output directory on request
+TIMINGS = "dLight timings.json"
+PROFILE = "dLight profile.prof"
+# columns of a manifest, animal is optional
+MANIFEST_COLUMNS = ["file", "offset", "condition"]
+# rows read at a time in chunked mode, values sampled from a recording to
+# find its median and MAD, and the share of the sample around its median
+# whose range is searched for the exact one
+CHUNK_ROWS = 1 << 20
+SAMPLE_SIZE = 1 << 16
+MEDIAN_SPREAD = 0.01
+
+
+class StridedSample:
+    # Every stride-th value of a stream, skipping NaN, the stride doubling
+    # and every other value going whenever the sample grows past twice its
+    # size, so memory does not grow with the stream. Being taken by rank,
+    # its quantiles are near those of the stream whatever the values are.
+
+    def __init__(self, size=SAMPLE_SIZE):
+        self.size = size
+        self.values = np.empty(0)
+        self.stride = 1
+        self.seen = 0
+
+    def add(self, values):
+        values = values[~np.isnan(values)]
+        self.values = np.concatenate((self.values, values[-self.seen % self.stride::self.stride]))
+        self.seen += len(values)
+        while len(self.values) > 2 * self.size:
+            self.values = self.values[::2]
+            self.stride *= 2
+
+
+def exact_median(chunks, sample, key=None, spread=MEDIAN_SPREAD):
+    # Median of the values of every chunk, after key if given, skipping NaN
+    # like np.nanmedian, without holding them all: each pass over chunks()
+    # counts the values below the range around the median of the sample
+    # and keeps those within it, which hold the middle values unless the
+    # sample was off, when the range widens. The last range takes every
+    # value, so it always ends. NaN when there are no values.
+    key = key or (lambda values: values)
+    sample = key(sample)
+    sample = sample[~np.isnan(sample)]
+    while True:
+        if spread < 0.5 and len(sample):
+            low = np.quantile(sample, 0.5 - spread, method="lower")
+            high = np.quantile(sample, 0.5 + spread, method="higher")
+        else:
+            low, high = -np.inf, np.inf
+        count, below, kept = 0, 0, []
+        for chunk in chunks():
+            values = key(chunk["ΔF/F"].to_numpy(dtype='float64'))
+            values = values[~np.isnan(values)]
+            count += len(values)
+            below += np.count_nonzero(values < low)
+            kept.append(values[(values >= low) & (values <= high)])
+        if count == 0:
+            return np.nan
+        kept = np.concatenate(kept)
+        middle = np.array([(count - 1) // 2, count // 2]) - below
+        if middle[0] >= 0 and middle[1] < len(kept):
+            return np.mean(np.partition(kept, middle)[middle])
+        spread *= 4
+
+
+def robust_z_score(values):
+    # Robust Z-Score of values, in place: 0.6745 * (x - median) / MAD, with
+    # MAD the median of the absolute deviations from the median
+    median = np.nanmedian(values)
+    MAD = np.nanmedian(np.abs(values - median))
+    np.subtract(values, median, out=values)
+    np.multiply(values, 0.6745, out=values)
+    np.divide(values, MAD, out=values)
+    return values
+
+def read_recording(filename, chunk_rows=None):
+    # the time and dF/F of a 'df_F.csv' recording, or an iterator over
+    # chunks of chunk_rows rows of them
+    return pd.read_csv(filename, usecols=[0, 1], names=['Time', 'ΔF/F'], float_precision="round_trip",
+                       chunksize=chunk_rows)
+
+def z_score_file(filename, save=False, cache=None, cache_size=CACHE_SIZE):
+    # Read a 'df_F.csv' recording, from the cache directory if it was read
+    # before, and z-score its dF/F, which the averaging takes straight from
+    # memory; saved as '_z-score.csv' if asked
+    df = cached(read_recording, filename, cache, "df_F", cache_size)
+    df['ΔF/F'] = robust_z_score(df['ΔF/F'].to_numpy(dtype='float64', copy=True))
+    if save:
+        df.to_csv(path.splitext(filename)[0] + "_z-score.csv", sep=',', encoding='utf-8', index=False, header=False)
+    return df
+
+def second_positions(times, stamp):
+    # Positions of the samples nearest to every second 1 + stamp, 2 + stamp...
+    # of the recording, through the first one past its end, found all at
+    # once by binary search in the sorted times so any sampling rate works.
+    # Seconds with the same nearest sample only count once.
+    times = np.asarray(times, dtype='float64')
+    targets = 1 + stamp + np.arange(max(int(np.ceil(times[-1] - 1 - stamp)), 0) + 1)
+    after = np.clip(np.searchsorted(times, targets), 1, len(times) - 1)
+    before = after - 1
+    # the earlier sample wins a tie, as argmin did
+    nearest = np.where(np.abs(times[before] - targets) <= np.abs(times[after] - targets), before, after)
+    if len(times) == 1:
+        nearest = np.zeros(len(targets), dtype=np.int64)
+    return np.unique(nearest)
+
+def segment_means(values, starts, ends):
+    # Mean of values[starts[i]:ends[i]] for every segment at once, skipping
+    # NaN like pandas does, and NaN for a segment with nothing in it
+    finite = ~np.isnan(values)
+    # reduceat sums from each bound to the next, so the segments are every
+    # other bound; two zeros at the end keep the bounds inside the array
+    bounds = np.column_stack((starts, ends)).ravel()
+    sums = np.add.reduceat(np.concatenate((np.where(finite, values, 0), [0, 0])), bounds)[::2]
+    counts = np.add.reduceat(np.concatenate((finite, [0, 0])).astype(np.int64), bounds)[::2]
+    counts[ends <= starts] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+def second_averages(times, average):
+    # Average 1 at the times of the sections, leaving out the sections
+    # without data the way empty averages were
+    kept = ~np.isnan(average)
+    return pd.DataFrame({"Time": times[kept], "Average 1": average[kept]})
+
+def average_seconds(df, c):
+    # Average 1 over the sections ending at the positions c, the first one
+    # from the start and every other from two rows past the previous end
+    c = np.asarray(c, dtype=np.int64)
+    starts = np.append(0, c[:-1] + 2)[:len(c)]
+    ends = np.append(c[:1] + 1, c[1:])
+    average = segment_means(df["ΔF/F"].to_numpy(dtype='float64'), starts, ends)
+    return second_averages(df["Time"].to_numpy()[c], average)
+
+def average_periods(averages, periods=PERIODS):
+    # each longer period as the mean of its whole blocks of Average 1
+    for step in periods[1:]:
+        blocks = len(averages) // step
+        column = np.full(len(averages), np.nan)
+        column[step - 1:blocks * step:step] = averages["Average 1"].to_numpy()[:blocks * step].reshape(blocks, step).mean(axis=1)
+        averages["Average " + str(step)] = column
+    return averages
+
+def treated_name(filename, out):
+    # the '_z-score_treated.xlsx' workbook of a recording, in out
+    return path.join(out, path.splitext(path.basename(filename))[0] + "_z-score_treated.xlsx")
+
+def animal_name(filename):
+    # the animal of a recording, its file name without ' - df_F.csv'
+    name = path.splitext(path.basename(filename))[0]
+    return name[:-len(" - df_F")] if name.endswith(" - df_F") else name
+
+def read_seconds(filename, stamp, save=False, cache=None, cache_size=CACHE_SIZE):
+    # Reads and z-scores a whole recording and averages it over the seconds
+    # after its timestamp. Returns those averages and the rows read.
+    df = z_score_file(filename, save, cache, cache_size)
+    return average_seconds(df, second_positions(df["Time"].to_numpy(), stamp)), df.shape[0]
+
+def stream_seconds(filename, stamp, save=False, chunk_rows=CHUNK_ROWS, sample_size=SAMPLE_SIZE, cache=None):
+    # read_seconds for recordings too long to hold in memory: the file is
+    # read chunk_rows at a time, keeping only a sample of dF/F and its
+    # running sums, from which the mean of every second is taken as soon
+    # as its section has been read. The z-score being linear, the mean
+    # z-score of a second is the z-score of its mean dF/F, known once the
+    # median and MAD are. Both are exact, see exact_median, at the cost of
+    # another pass over the file for each, and one more to save the
+    # z-scores. A recording already in the cache directory is read from
+    # there, but chunks are never added to it.
+    sample = StridedSample(sample_size)
+    records = lookup(filename, cache, "df_F")
+    # positions of the seconds with their times, and the positions of the
+    # section bounds with the running sum of dF/F up to them and count of
+    # its values, of +inf and of -inf, kept apart so they only reach the
+    # seconds they are in
+    positions, times = [], []
+    bounds, sums, counts = [0], [], []
+    # target seconds so far, rows read and the sum, count and time of the last row before the chunk
+    seconds, rows, total, count, last = 0, 0, 0.0, np.zeros(3, dtype=np.int64), None
+
+    def add_position(position, time):
+        # a new section ends at position, the first one just after it
+        if positions and positions[-1] == position:
+            return
+        bounds.extend([position + 1 if not positions else position, position + 2])
+        positions.append(position)
+        times.append(time)
+
+    def resolve(first, running, numbers):
+        # sums and counts of the pending bounds within the rows from first
+        while len(sums) < len(bounds) and bounds[len(sums)] - first < len(running):
+            row = bounds[len(sums)] - first
+            sums.append(running[row])
+            counts.append(numbers[row])
+
+    def chunks():
+        if records is None:
+            return read_recording(filename, chunk_rows)
+        return (frame(records[start:start + chunk_rows]) for start in range(0, len(records), chunk_rows))
+
+    for chunk in chunks():
+        time = chunk["Time"].to_numpy(dtype='float64')
+        values = chunk["ΔF/F"].to_numpy(dtype='float64')
+        sample.add(values)
+
+        # the seconds up to the last time of the chunk, nearest to a row
+        # of the chunk or to the row before it, as second_positions does
+        first = rows if last is None else rows - 1
+        near = time if last is None else np.concatenate(([last[2]], time))
+        targets = 1 + stamp + np.arange(seconds, max(int(np.floor(time[-1] - 1 - stamp)) + 2, seconds))
+        targets = targets[targets <= time[-1]]
+        seconds += len(targets)
+        if len(targets) and len(near) == 1:
+            add_position(first, near[0])
+        elif len(targets):
+            after = np.clip(np.searchsorted(near, targets), 1, len(near) - 1)
+            before = after - 1
+            nearest = np.where(np.abs(near[before] - targets) <= np.abs(near[after] - targets), before, after)
+            for position in nearest:
+                add_position(first + position, near[position])
+
+        # running sums from the row before the chunk, skipping NaN
+        finite = np.isfinite(values)
+        running = np.cumsum(np.concatenate(([total], np.where(finite, values, 0))))
+        kinds = np.column_stack((~np.isnan(values), values == np.inf, values == -np.inf))
+        numbers = np.cumsum(np.concatenate(([count], kinds)), axis=0)
+        if last is not None:
+            running = np.concatenate(([last[0]], running))
+            numbers = np.concatenate(([last[1]], numbers))
+        resolve(first, running, numbers)
+        last = (running[-2], numbers[-2], time[-1])
+        total, count = running[-1], numbers[-1]
+        rows += len(values)
+
+    if rows == 0:
+        raise ValueError("%s is empty" % filename)
+    # the last second past the end is nearest to the last row
+    if seconds <= max(int(np.ceil(last[2] - 1 - stamp)), 0):
+        add_position(rows - 1, last[2])
+    resolve(rows - 1, [last[0], total], [last[1], count])
+    # bounds past the end take the sums of the whole recording
+    sums.extend([total] * (len(bounds) - len(sums)))
+    counts.extend([count] * (len(bounds) - len(counts)))
+
+    sums, counts = np.array(sums[:2 * len(positions)]), np.array(counts[:2 * len(positions)]).reshape(-1, 3)
+    number, up, down = (counts[1::2] - counts[::2]).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = np.where(number > 0, (sums[1::2] - sums[::2]) / np.maximum(number, 1), np.nan)
+    # a second with an infinity averages to it, or to NaN with both
+    average = np.where(up > 0, np.where(down > 0, np.nan, np.inf), np.where(down > 0, -np.inf, average))
+    median = exact_median(chunks, sample.values)
+    MAD = exact_median(chunks, sample.values, lambda values: np.abs(values - median))
+    average = 0.6745 * (average - median) / MAD
+
+    if save:
+        z_score = path.splitext(filename)[0] + "_z-score.csv"
+        for i, chunk in enumerate(chunks()):
+            chunk['ΔF/F'] = 0.6745 * (chunk['ΔF/F'] - median) / MAD
+            chunk.to_csv(z_score, mode='w' if i == 0 else 'a', sep=',', encoding='utf-8', index=False, header=False)
+    return second_averages(np.array(times), average), rows
+
+def treat_recording(df, treated, periods=PERIODS, max_time=MAX_TIME, constant_memory=False):
+    # Averages the seconds of a recording over each period, and writes the
+    # averages to the workbook treated. Returns the averages of every
+    # period without the gaps between them, as on the Graphpad sheet, for
+    # the cohort.
+    df = average_periods(df, periods)
+    df.drop(df.index[max_time:], inplace=True)
+    averages = {period: df["Average " + str(period)].dropna().to_numpy() for period in periods}
+    df2 = pd.DataFrame({"Average " + str(period): pd.Series(averages[period]) for period in periods})
+    write_workbook(treated, [("dF_F Averages", df), ("Graphpad", df2)], constant_memory)
+    return averages
+
+def treat(filename, stamp, treated, periods=PERIODS, max_time=MAX_TIME, constant_memory=False, save=False,
+          chunk_rows=None, cache=None, cache_size=CACHE_SIZE):
+    # Runs in a worker process: z-scores one recording and averages its
+    # seconds, chunk_rows rows at a time if given, and writes its treated
+    # workbook. Returns its averages of every period, only a few thousand
+    # numbers, with the rows read and the time and memory of both steps
+    # for the profiler of the run.
+    if chunk_rows:
+        read = partial(stream_seconds, chunk_rows=chunk_rows, cache=cache)
+    else:
+        read = partial(read_seconds, cache=cache, cache_size=cache_size)
+    (df, rows), z_score = measured(read, filename, stamp, save)
+    averages, average = measured(treat_recording, df, treated, periods, max_time, constant_memory)
+    return averages, rows, z_score, average
+
+def read_manifest(filename):
+    # The recordings of a manifest, a csv with a row of file, offset and
+    # condition for every animal and optionally its animal name. Files are
+    # relative to the manifest, and animals are named after their files
+    # when not given. Animals without a condition are treated but left
+    # out of the cohort.
+    manifest = pd.read_csv(filename, skipinitialspace=True, dtype={"file": str, "condition": str})
+    missing = [column for column in MANIFEST_COLUMNS if column not in manifest.columns]
+    if missing:
+        raise ValueError("%s has no %s column" % (filename, ", ".join(missing)))
+    folder = path.dirname(path.abspath(filename))
+    manifest["file"] = [path.join(folder, file) for file in manifest["file"]]
+    if "animal" not in manifest.columns:
+        manifest["animal"] = [animal_name(file) for file in manifest["file"]]
+    return manifest
+
+def cohort_order(manifest, conditions=None):
+    # the rows of manifest with a condition, grouped by condition in the
+    # order of conditions, or else the order they first appear in, and in
+    # manifest order within each condition, whatever the directory order
+    if conditions is None:
+        conditions = list(dict.fromkeys(manifest["condition"].dropna()))
+    return [row for condition in conditions for row in range(len(manifest))
+            if manifest["condition"].iloc[row] == condition]
+
+def write_cohort(filename, animals, averages, periods=PERIODS, constant_memory=False):
+    # Writes the averages of every animal, as returned by treat, to
+    # filename, a sheet per period with a column per animal in the order
+    # given, straight from memory rather than from the treated workbooks
+    workbook = open_workbook(filename, constant_memory)
+    for period in periods:
+        df = pd.DataFrame({animal: pd.Series(average[period]) for animal, average in zip(animals, averages)})
+        df.insert(0, "Timestamps", [(i + 1) * period / 86400 for i in range(df.shape[0])])
+        write_sheet(workbook, "Average " + str(period), df)
+    workbook.close()
+
+def run(manifest, out, periods=PERIODS, max_time=MAX_TIME, conditions=None, workers=None, constant_memory=False,
+        save=False, profiler=None, chunk_rows=None, cache=None, cache_size=CACHE_SIZE):
+    # Treats every recording of manifest across workers processes (one per
+    # core by default), chunk_rows rows at a time if given, and writes the
+    # cohort workbook to out. Each animal has its own workbook named after
+    # its recording, and the cohort follows the manifest, so the output
+    # does not depend on which recording finishes first. With a cache
+    # directory the recordings parsed once are kept there, up to
+    # cache_size bytes, for the next runs.
+    files = manifest["file"].tolist()
+    treated = [treated_name(file, out) for file in files]
+    task = partial(treat, periods=periods, max_time=max_time, constant_memory=constant_memory, save=save,
+                   chunk_rows=chunk_rows, cache=cache, cache_size=cache_size)
+    with timed(profiler, "treat"):
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(task, files, manifest["offset"].astype(float).tolist(), treated))
+    if profiler is not None:
+        for file, (_, rows, z_score, average) in zip(files, results):
+            profiler.add("z-score", path.basename(file), rows, **z_score)
+            profiler.add("average", path.basename(file), rows, **average)
+
+    with timed(profiler, "cohort"):
+        order = cohort_order(manifest, conditions)
+        write_cohort(path.join(out, COHORT), manifest["animal"].iloc[order].tolist(),
+                     [results[row][0] for row in order], periods, constant_memory)
+
+def main(argv=None):
+    parser = ArgumentParser(description="Treat the dLight recordings of a cohort: z-score, average over every "
+                                        "period and collect the averages of all animals.")
+    parser.add_argument("manifest", help="csv with a row of file, offset (the timestamp of the recording in "
+                                         "seconds) and condition for every animal, and optionally its animal name")
+    parser.add_argument("-o", "--out", help="output directory (default: the directory of the manifest)")
+    parser.add_argument("--periods", type=int, nargs="+", default=PERIODS,
+                        help="seconds of every average, starting with 1 (default: %s)" % " ".join(map(str, PERIODS)))
+    parser.add_argument("--max-time", type=int, default=MAX_TIME,
+                        help="seconds of every recording kept (default: %d)" % MAX_TIME)
+    parser.add_argument("--conditions", nargs="+",
+                        help="order of the conditions in the cohort (default: as they first appear in the manifest)")
+    parser.add_argument("--workers", type=int, help="processes used to treat the recordings (default: one per core)")
+    parser.add_argument("--chunked", type=int, nargs="?", const=CHUNK_ROWS, metavar="ROWS",
+                        help="read the recordings ROWS rows at a time (default: %d) with the exact median and MAD "
+                             "in a few passes, for recordings too long to hold in memory" % CHUNK_ROWS)
+    parser.add_argument("--cache", metavar="DIRECTORY",
+                        help="keep the parsed recordings in DIRECTORY, so later runs on them skip parsing the csv")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE // (1 << 20), metavar="MB",
+                        help="size of the cache, the least recently used recordings go first (default: %d)"
+                             % (CACHE_SIZE // (1 << 20)))
+    parser.add_argument("--z-score", action="store_true", help="also save every z-scored recording as '_z-score.csv'")
+    parser.add_argument("--constant-memory", action="store_true",
+                        help="stream the Excel workbooks to disk row by row, with filters instead of tables")
+    parser.add_argument("--timings", action="store_true",
+                        help="write the time, memory and rows of every stage and recording to " + TIMINGS)
+    parser.add_argument("--profile", action="store_true", help="also profile the run with cProfile into " + PROFILE)
+    args = parser.parse_args(argv)
+    if args.periods[0] != 1:
+        parser.error("the first period must be 1 second, the others are averaged from it")
+    if args.chunked is not None and args.chunked < 1:
+        parser.error("chunks need at least one row")
+
+    manifest = read_manifest(args.manifest)
+    out = args.out or path.dirname(path.abspath(args.manifest))
+    makedirs(out, exist_ok=True)
+    profiler = None
+    if args.timings or args.profile:
+        profiler = Profiler(path.join(out, PROFILE) if args.profile else None)
+
+    run(manifest, out, args.periods, args.max_time, args.conditions, args.workers, args.constant_memory,
+        args.z_score, profiler, args.chunked, args.cache, args.cache_size << 20)
+
+    if profiler is not None:
+        profiler.write(path.join(out, TIMINGS))
+        print(profiler.summary())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import xlsxwriter
+
+# width of the columns of every sheet, autofit is too slow on big sheets
+MIN_WIDTH = 10
+# infinite values, written as text like DataFrame.to_excel does
+INFINITIES = {float("inf"), float("-inf")}
+
+
+def open_workbook(filename, constant_memory=False):
+    # an xlsxwriter workbook. In constant memory mode every row is flushed
+    # to disk once written, so big workbooks take little RAM, but Excel
+    # tables are not available and the header row gets a filter instead.
+    return xlsxwriter.Workbook(filename, {"constant_memory": constant_memory})
+
+def column_widths(df, width=None):
+    # width if given, or one wide enough for each header and its filter button
+    if width is not None:
+        return [width] * df.shape[1]
+    return [max(len(str(column)) + 3, MIN_WIDTH) for column in df.columns]
+
+def write_sheet(workbook, name, df, width=None, num_format=2):
+    # writes df to a new sheet of workbook as a table under a header row,
+    # centred with num_format. The cells are written straight from the
+    # column arrays, row by row so that it also works in constant memory
+    # mode; missing values and empty strings are left blank, and infinite
+    # values are written as "inf" and "-inf".
+    worksheet = workbook.add_worksheet(name)
+    cell_format = workbook.add_format({"align": "center", "num_format": num_format})
+    (max_row, max_col) = df.shape
+    headers = [str(column) for column in df.columns]
+
+    for col, size in enumerate(column_widths(df, width)):
+        worksheet.set_column(col, col, size, cell_format)
+    worksheet.write_row(0, 0, headers)
+
+    columns = [df.iloc[:, col].to_numpy().tolist() for col in range(max_col)]
+    write_number, write_string = worksheet.write_number, worksheet.write_string
+    for row, values in enumerate(zip(*columns), 1):
+        for col, value in enumerate(values):
+            if value is None or value != value or value == "":
+                continue
+            if isinstance(value, str):
+                write_string(row, col, value)
+            elif value in INFINITIES:
+                write_string(row, col, str(value))
+            else:
+                write_number(row, col, value)
+
+    if max_col > 0:
+        if workbook.constant_memory:
+            worksheet.autofilter(0, 0, max_row, max_col - 1)
+        else:
+            worksheet.add_table(0, 0, max_row, max_col - 1, {"columns": [{"header": header} for header in headers]})
+    return worksheet
+
+def write_workbook(filename, sheets, constant_memory=False, width=None, num_format=2):
+    # writes every (name, df) of sheets to a new workbook at filename
+    workbook = open_workbook(filename, constant_memory)
+    for name, df in sheets:
+        write_sheet(workbook, name, df, width, num_format)
+    workbook.close()
@@ -0,0 +1,138 @@
+import json
+import cProfile
+import sys
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from importlib import util
+from os import times
+from time import perf_counter
+
+if util.find_spec("resource"):
+    import resource
+
+MB = 1024 * 1024
+
+
+def peak_rss():
+    # peak resident memory in MB of this process or of the largest worker
+    # process that has finished, whichever is higher, None where getrusage
+    # is missing. ru_maxrss is in bytes on macOS and in kB elsewhere.
+    if not util.find_spec("resource"):
+        return None
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return usage / (MB if sys.platform == "darwin" else 1024)
+
+def cpu_time():
+    # CPU seconds of this process and of the worker processes that have
+    # finished (those are only counted on Unix)
+    t = times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def measured(function, *args):
+    # runs function(*args) and returns its result with the time and memory
+    # it took, so work done in a worker process can be added to a Profiler
+    wall, cpu = perf_counter(), cpu_time()
+    result = function(*args)
+    return result, {"wall_s": perf_counter() - wall, "cpu_s": cpu_time() - cpu, "peak_rss_mb": peak_rss()}
+
+def timed(profiler, name, file=None, rows=None):
+    # profiler.stage, or a block that is not timed when there is no profiler
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, file, rows)
+
+
+class Profiler:
+    # Records the wall time, CPU time, peak memory and rows processed of
+    # every stage of a run, with an optional breakdown per file, and writes
+    # them as JSON. The peak RSS of a stage is the peak of the process up
+    # to its end; with memory set, tracemalloc also gives the peak of the
+    # Python and numpy allocations made during each stage, at some cost in
+    # speed. With profile, the run is also profiled with cProfile (worker
+    # processes are left out) and the stats are dumped to that file.
+
+    def __init__(self, profile=None, memory=False):
+        self.records = []
+        self.started = datetime.now()
+        self.start = perf_counter()
+        self.profile = profile
+        self.profiler = None
+        if profile is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, file=None, rows=None):
+        # times the with block, rows can also be set on the yielded record
+        # once they are known, or else add up the rows of the files of the
+        # stage added during the block
+        record = {"stage": name, "file": file, "rows": rows}
+        first = len(self.records)
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        wall, cpu = perf_counter(), cpu_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = perf_counter() - wall
+            record["cpu_s"] = cpu_time() - cpu
+            record["peak_rss_mb"] = peak_rss()
+            if tracemalloc.is_tracing():
+                record["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / MB
+            if record["rows"] is None:
+                rows = [r["rows"] for r in self.records[first:] if r["stage"] == name and r["rows"] is not None]
+                record["rows"] = sum(rows) if rows else None
+            self.records.append(record)
+
+    def add(self, name, file=None, rows=None, **measures):
+        # a stage timed elsewhere, like in a worker process with measured
+        self.records.append(dict(stage=name, file=file, rows=rows, **measures))
+
+    def report(self):
+        # the stages in the order they ran and the per file breakdown, ready
+        # for json. A stage that was only timed file by file is totalled
+        # from its files.
+        files = [record for record in self.records if record["file"] is not None]
+        totalled = {record["stage"] for record in self.records if record["file"] is None}
+        stages = []
+        for record in self.records:
+            if record["file"] is None:
+                stages.append(record)
+            elif record["stage"] not in totalled:
+                totalled.add(record["stage"])
+                parts = [part for part in files if part["stage"] == record["stage"]]
+                rows = [part["rows"] for part in parts if part["rows"] is not None]
+                peaks = [part["peak_rss_mb"] for part in parts if part["peak_rss_mb"] is not None]
+                stages.append({"stage": record["stage"], "file": None, "rows": sum(rows) if rows else None,
+                               "wall_s": sum(part["wall_s"] for part in parts),
+                               "cpu_s": sum(part["cpu_s"] for part in parts),
+                               "peak_rss_mb": max(peaks) if peaks else None})
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_s": perf_counter() - self.start,
+            "stages": stages,
+            "files": files,
+        }
+
+    def summary(self):
+        # one line per stage, to print at the end of a run
+        lines = []
+        for record in self.report()["stages"]:
+            line = "%-12s%9.3f s wall%9.3f s CPU" % (record["stage"], record["wall_s"], record["cpu_s"])
+            if record["rows"]:
+                line += "%12d rows" % record["rows"]
+            if record["peak_rss_mb"] is not None:
+                line += "%10.1f MB" % record["peak_rss_mb"]
+            lines.append(line)
+        return "\n".join(lines)
+
+    def write(self, filename):
+        # writes the report to filename, and the cProfile stats if asked for
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
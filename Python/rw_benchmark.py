@@ -0,0 +1,71 @@
+import random
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from os import path
+from tempfile import TemporaryDirectory
+from instrument import Profiler
+from rw_converter import convert
+
+# wheel turns of a reading, mostly still with the odd burst of running
+READINGS = [0, 0, 0, 0, 1, 2, 3, 5, 8, 13, 21]
+
+
+def generate_log(filename, cages=8, days=3, start="2023-05-01 13:37:12", interval=30, seed=0):
+    # writes a running wheel log like the ones of the racks, a reading of
+    # every cage each interval seconds (give or take a couple) for days,
+    # starting at start and ending part way through the last day. Returns
+    # the number of lines written.
+    rng = random.Random(seed)
+    time = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+    end = time.replace(hour=0, minute=0, second=0) + timedelta(days=days, seconds=-rng.randint(3600, 36000))
+    lines = 0
+    with open(filename, "w") as f:
+        while time < end:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            f.write("".join('"%s:%03d", Cage %d: %d\n' % (stamp, rng.randint(0, 999), cage, rng.choice(READINGS))
+                            for cage in range(1, cages + 1)))
+            lines += cages
+            time += timedelta(seconds=interval + rng.randint(-2, 2))
+    return lines
+
+def generate_racks(directory, racks=2, cages=8, days=3, interval=30, seed=0):
+    # one log per rack in directory, each rack with its own readings
+    logs = []
+    lines = 0
+    for rack in range(racks):
+        logs.append(path.join(directory, "rack %d.txt" % (rack + 1)))
+        lines += generate_log(logs[-1], cages, days, interval=interval, seed=seed + rack)
+    return logs, lines
+
+def benchmark(logs, out, workers=None, schedule=0, raw=1):
+    # converts logs with every Excel workbook and returns the report of a
+    # Profiler on the run, with the stages and the parse of every log
+    profiler = Profiler()
+    convert(logs, out, schedule, raw, adjusted_only=0, workers=workers, report=lambda text: None, profiler=profiler)
+    return profiler.report()
+
+def main(argv=None):
+    parser = ArgumentParser(description="Benchmark the running wheel converter on generated logs.")
+    parser.add_argument("--racks", type=int, default=2, help="logs to generate, one per rack (default: 2)")
+    parser.add_argument("--cages", type=int, default=8, help="cages of every rack (default: 8)")
+    parser.add_argument("--days", type=int, default=7, help="days of every log (default: 7)")
+    parser.add_argument("--interval", type=int, default=30, help="seconds between readings (default: 30)")
+    parser.add_argument("--workers", type=int, help="processes used to parse the logs (default: one per core)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the benchmark (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated readings (default: 0)")
+    parser.add_argument("--logs", help="keep the generated logs in this directory instead of a temporary one")
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory:
+        logs, lines = generate_racks(args.logs or directory, args.racks, args.cages, args.days, args.interval, args.seed)
+        size = sum(path.getsize(log) for log in logs)
+        print("%d logs, %d lines, %.1f MB" % (len(logs), lines, size / 1048576))
+        for repeat in range(args.repeat):
+            print("Run %d" % (repeat + 1))
+            # throughput is in log lines for every stage, so they compare
+            for stage in benchmark(logs, directory, args.workers)["stages"]:
+                print("  %-8s%9.3f s%14s lines/s" % (stage["stage"], stage["wall_s"], format(lines / stage["wall_s"], ",.0f"))
+                      + ("" if stage["peak_rss_mb"] is None else "%10.1f MB" % stage["peak_rss_mb"]))
+
+if __name__ == "__main__":
+    main()
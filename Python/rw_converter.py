@@ -0,0 +1,841 @@
+import re
+import pickle
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Manager
+from os import path, remove, replace, cpu_count
+from queue import Empty, SimpleQueue
+from threading import Event
+from time import sleep, strftime
+import numpy as np
+import pandas as pd
+from instrument import Profiler, measured, timed
+from excel_export import write_workbook
+
+# number of seconds of time bin
+TIME_BIN = 360
+BINS_PER_DAY = 86400 // TIME_BIN
+# bytes of log handed to the binning engine at a time
+CHUNK_SIZE = 1 << 22
+# bin state of incremental runs, kept in the output directory
+CHECKPOINT = "rw_checkpoint.pkl"
+# stage timings and cProfile stats, written to the output directory on request
+TIMINGS = "rw_timings.json"
+PROFILE = "rw_profile.prof"
+# wheel turns to km
+KM_PER_TURN = 40.84/100000
+# columnar outputs, extensions are added for the format
+COLUMNAR_BINS = "Final Bins"
+COLUMNAR_SUMS = "Final Sums"
+COLUMNAR_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+# lights on and lights off hours of the two day-night schedules
+SCHEDULES = {0: (6, 18), 1: (7, 19)}
+
+# fields of a log line: "YYYY-MM-DD HH:MM:SS:fff", Cage N: count
+line_pattern = re.compile(rb'"(\d+-\d+-\d+) (\d+):(\d+):(\d+):(\d+)",\s*Cage\s*([^:\r\n]*?)\s*:\s*(\d+)')
+
+
+def decode_timestamps(fields):
+    # Decodes the fixed "YYYY-MM-DD HH:MM:SS:fff" layout for a whole block of
+    # lines at once, without going through strptime. Returns the day number
+    # and the time of day of each line in microseconds. Times are taken as
+    # wall-clock time, the way they are written in the log.
+    day_number = fields[:, 0].astype("datetime64[D]").astype(np.int64)
+    clock = fields[:, 1:4].astype(np.int64) @ np.array([3600, 60, 1])
+    # the fraction is read like %f does, so "5" is half a second
+    fraction = np.char.ljust(fields[:, 4], 6, b"0").astype("S6").astype(np.int64)
+    return day_number, clock * 1000000 + fraction
+
+def read_digits(data, first, length):
+    # value of the digits data[first:first + length] of every line, or None
+    # when one of them is not a digit
+    value = np.zeros(len(first), dtype=np.int64)
+    for k in range(int(length.max())):
+        inside = k < length
+        digit = data[np.where(inside, first + k, 0)] - 48
+        if (digit[inside] > 9).any():
+            return None
+        value = np.where(inside, value * 10 + digit, value)
+    return value
+
+def skip_spaces(data, position, stop):
+    # moves every position past the spaces it is on, up to stop
+    position = position.copy()
+    while True:
+        space = (position < stop) & (data[np.minimum(position, len(data) - 1)] == 32)
+        if not space.any():
+            return position
+        position[space] += 1
+
+def strip_back(data, position, stop, characters):
+    # moves every position back past the characters before it, down to stop
+    position = position.copy()
+    characters = np.frombuffer(characters, dtype=np.uint8)
+    while True:
+        strip = (position > stop) & np.isin(data[position - 1], characters)
+        if not strip.any():
+            return position
+        position[strip] -= 1
+
+def scan_layout(buffer, start, end):
+    # scan of lines laid out exactly as the racks write them, decoded from
+    # the bytes with array operations and no object per line. None when a
+    # line is laid out any other way, the regex then takes over.
+    data = np.frombuffer(buffer, dtype=np.uint8, count=end - start, offset=start)
+    if len(data) == 0:
+        return None
+    ends = np.flatnonzero(data == 10)
+    if len(ends) == 0 or ends[-1] != len(data) - 1:
+        ends = np.append(ends, len(data))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # blank lines are skipped, as the regex does
+    blank = (ends == starts) | ((ends - starts == 1) & (data[np.minimum(starts, len(data) - 1)] == 13))
+    starts, ends = starts[~blank], ends[~blank]
+    if len(starts) == 0 or (ends - starts < 30).any():
+        return None
+
+    # "YYYY-MM-DD HH:MM:SS:f..." sits at fixed places, but for the fraction
+    fixed = data[starts[:, None] + np.arange(21)]
+    if (fixed[:, [0, 5, 8, 11, 14, 17, 20]] != np.frombuffer(b'"-- :::', dtype=np.uint8)).any():
+        return None
+    digits = fixed[:, [1, 2, 3, 4, 6, 7, 9, 10, 12, 13, 15, 16, 18, 19]] - 48
+    if (digits > 9).any():
+        return None
+    number = digits.astype(np.int64).reshape(-1, 7, 2) @ np.array([10, 1])
+    year = number[:, 0] * 100 + number[:, 1]
+    month, day, hours, minutes, seconds = number[:, 2:].T
+    # days since 1970-01-01 of the proleptic Gregorian calendar
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_number = era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+
+    quotes = np.flatnonzero(data == 34)
+    quote = quotes[np.minimum(np.searchsorted(quotes, starts + 21), len(quotes) - 1)]
+    length = quote - (starts + 21)
+    if ((length < 1) | (length > 6)).any() or (quote >= ends).any():
+        return None
+    fraction = read_digits(data, starts + 21, length)
+    if fraction is None:
+        return None
+    time_of_day = ((hours * 3600 + minutes * 60 + seconds) * 1000000 + fraction * 10 ** (6 - length))
+
+    # , Cage name: reading
+    if (data[quote + 1] != 44).any():
+        return None
+    word = skip_spaces(data, quote + 2, ends)
+    if (ends - word < 6).any() or (data[word[:, None] + np.arange(4)] != np.frombuffer(b"Cage", dtype=np.uint8)).any():
+        return None
+    name = skip_spaces(data, word + 4, ends)
+    colons = np.flatnonzero(data == 58)
+    colon = colons[np.minimum(np.searchsorted(colons, name), len(colons) - 1)] if len(colons) else ends
+    if (colon < name).any() or (colon >= ends).any():
+        return None
+    name_end = strip_back(data, colon, name, b" ")
+    width = max(int((name_end - name).max()), 1)
+    letters = data[np.minimum(name[:, None] + np.arange(width), len(data) - 1)]
+    letters = np.where(np.arange(width) < (name_end - name)[:, None], letters, 0).astype(np.uint8)
+    if (letters == 13).any():
+        return None
+    cages = np.ascontiguousarray(letters).view("S%d" % width).ravel()
+
+    # the reading runs to the end of the line, but for trailing spaces and
+    # the carriage return
+    reading = skip_spaces(data, colon + 1, ends)
+    count = strip_back(data, ends, reading, b" \r") - reading
+    if (count < 1).any() or (count > 18).any():
+        return None
+    readings = read_digits(data, reading, count)
+    if readings is None:
+        return None
+    return day_number, time_of_day, cages, readings
+
+def scan(buffer, start=0, end=None):
+    # finds the lines of buffer[start:end] straight in its bytes, buffer
+    # may be a memory map, and decodes them into day numbers, times of day,
+    # cage names and readings. None when there are no lines.
+    end = len(buffer) if end is None else end
+    scanned = scan_layout(buffer, start, end)
+    if scanned is not None:
+        return scanned
+    rows = line_pattern.findall(buffer, start, end)
+    if not rows:
+        return None
+    fields = np.array(rows)
+    day_number, time_of_day = decode_timestamps(fields)
+    return day_number, time_of_day, fields[:, 5], fields[:, 6].astype(np.int64)
+
+def scan_range(filename, start, end):
+    # scan of bytes start to end of filename through a memory map, so
+    # that worker processes can each scan a part of the same log
+    with open(filename, "rb") as f, mmap(f.fileno(), 0, access=ACCESS_READ) as buffer:
+        return scan(buffer, start, end)
+
+def chunk_bounds(buffer, start, end, size=CHUNK_SIZE):
+    # splits buffer[start:end] into chunks of about size bytes that end
+    # right after a newline, so that no line is cut in two
+    while start < end:
+        stop = end
+        if start + size < end:
+            stop = buffer.find(b"\n", start + size - 1, end) + 1 or end
+        yield start, stop
+        start = stop
+
+class LogBinner:
+    # Sums the readings of every cage of one log into TIME_BIN slots, one
+    # day per row. The log is read in blocks of CHUNK_SIZE bytes and each
+    # block is binned with array operations; the bin state of the last line
+    # (day, base timestamp, position) is carried over to the next block.
+    # All of that state lives on the binner, so it can be pickled into a
+    # checkpoint and carry on later with the lines appended since.
+    #
+    # A line opens a new bin when it is at least TIME_BIN past the current
+    # bin start, and only one bin is opened per line, so after a gap in the
+    # log the bins catch up one line at a time. With f the number of whole
+    # bins between the first line of the day and the line, that is
+    #   position[i] = min(max(f[:i + 1]), position[i - 1] + 1)
+    # which unrolls to i + cummin(cummax(f) - i) within each day.
+
+    def __init__(self):
+        self.names = {}
+        self.counts = np.zeros((0, 0, BINS_PER_DAY), dtype=np.int64)  # day x cage x bin
+        self.first_bins = 0  # bins opened on the first day
+        self.start = 0  # second of the day the log starts at
+
+        self.day = None
+        self.line_index = -1
+        self.base_timestamp = 0
+        self.position_index = -1
+        self.peak = -1
+        self.dropped = 0  # days let go of by trim
+
+        self.offset = 0  # bytes of the log binned so far
+        self.head = b""  # first bytes of the log, to recognise it later
+
+    def matches(self, filename):
+        # whether filename is still the log this binner has been reading,
+        # and not a new log written under the same name
+        with open(filename, "rb") as f:
+            return f.read(len(self.head)) == self.head and f.seek(0, 2) >= self.offset
+
+    def read(self, filename, final=True, progress=None):
+        # bins the lines added to filename since the last read, a last line
+        # without a newline is still being written and is left for the next
+        # read unless final is set. progress is called with the filename,
+        # the bytes binned so far and the lines of this read after every
+        # block, and may raise Cancelled to stop the read.
+        lines = self.lines_read = 0
+        start = self.offset
+        with open(filename, "rb") as f:
+            if self.offset == 0:
+                self.head = f.read(4096)
+            f.seek(self.offset)
+            for block in iter(lambda: f.readlines(CHUNK_SIZE), []):
+                if not final and not block[-1].endswith(b"\n"):
+                    block.pop()
+                data = b"".join(block)
+                self.feed(data)
+                self.offset += len(data)
+                lines += len(block)
+                self.lines_read = lines
+                if progress is not None:
+                    progress(filename, self.offset, lines)
+        self.bytes_read = self.offset - start
+        return self
+
+    def read_mapped(self, filename, final=True, progress=None, pool=None, ahead=1):
+        # read through a memory map of filename, the lines are scanned
+        # straight from the mapped bytes in newline aligned chunks, by the
+        # processes of pool when given with up to ahead chunks in flight,
+        # and binned here in the order of the log
+        lines = self.lines_read = 0
+        start = self.offset
+        with open(filename, "rb") as f:
+            if self.offset == 0:
+                self.head = f.read(4096)
+            size = f.seek(0, 2)
+            if size <= self.offset:
+                bounds = []
+            else:
+                with mmap(f.fileno(), 0, access=ACCESS_READ) as buffer:
+                    end = size if final else buffer.rfind(b"\n", self.offset) + 1
+                    bounds = list(chunk_bounds(buffer, self.offset, max(end, self.offset)))
+
+        if pool is None:
+            scans = (scan_range(filename, *bound) for bound in bounds)
+        else:
+            scans = ordered(pool, partial(scan_range, filename), bounds, ahead)
+        for (_, stop), scanned in zip(bounds, scans):
+            if scanned is not None:
+                self.feed_scanned(*scanned)
+                lines += len(scanned[0])
+            self.offset = stop
+            self.lines_read = lines
+            if progress is not None:
+                progress(filename, self.offset, lines)
+        self.bytes_read = self.offset - start
+        return self
+
+    def feed(self, block):
+        # bins a block of whole lines
+        scanned = scan(block)
+        if scanned is not None:
+            self.feed_scanned(*scanned)
+
+    def feed_scanned(self, day_number, time_of_day, cages, readings):
+        # bins the scan of a block of lines
+        curr_time = day_number * 86400000000 + time_of_day
+
+        if self.day is None:
+            self.start = int(time_of_day[0] // 1000000)
+
+        # segment 0 continues the day of the previous block, every
+        # other segment is a new day
+        new_day = np.empty(len(day_number), dtype=bool)
+        new_day[0] = day_number[0] != self.day
+        new_day[1:] = day_number[1:] != day_number[:-1]
+        segment = np.cumsum(new_day)
+        starts = np.concatenate(([0], np.flatnonzero(new_day)))
+        bases = np.concatenate(([self.base_timestamp], curr_time[starts[1:]]))
+
+        local_index = np.arange(len(day_number)) - starts[segment]
+        elapsed = (curr_time - bases[segment]) // (TIME_BIN * 1000000)
+        carried = segment == 0
+        elapsed[carried] = np.maximum(elapsed[carried], self.peak)
+        elapsed = pd.Series(elapsed).groupby(segment).cummax().to_numpy()
+        lag = elapsed - local_index
+        lag[carried] = np.minimum(lag[carried], self.position_index + 1)
+        position = local_index + pd.Series(lag).groupby(segment).cummin().to_numpy()
+
+        line = self.line_index + segment
+        self.day = day_number[-1]
+        self.line_index = int(line[-1])
+        self.base_timestamp = bases[-1]
+        self.position_index = int(position[-1])
+        self.peak = int(elapsed[-1])
+
+        # cages keep the order they first appear in
+        names = self.names
+        found, first, code = np.unique(cages, return_index=True, return_inverse=True)
+        for cage in found[np.argsort(first)]:
+            names.setdefault(cage.decode(), len(names))
+        code = np.array([names[cage.decode()] for cage in found])[code.ravel()]
+
+        if position.max() >= BINS_PER_DAY:
+            raise ValueError("More than a day of bins on day %d of the log" % self.line_index)
+        if line[0] == 0 and self.dropped == 0:
+            self.first_bins = int(position[line == 0].max()) + 1
+
+        # grow the array to fit the days and cages of this block, days
+        # are doubled so that long logs are only copied a few times
+        counts = self.counts
+        if self.line_index >= counts.shape[0] or len(names) > counts.shape[1]:
+            grown = np.zeros((max(self.line_index + 1, 2 * counts.shape[0]), len(names), BINS_PER_DAY), dtype=np.int64)
+            grown[:counts.shape[0], :counts.shape[1]] = counts
+            self.counts = counts = grown
+
+        # sum every (day, cage, bin) group of the block in one pass
+        first_line = int(line[0])
+        span = self.line_index + 1 - first_line
+        group = ((line - first_line) * len(names) + code) * BINS_PER_DAY + position
+        sums = np.bincount(group, weights=readings, minlength=span * len(names) * BINS_PER_DAY)
+        counts[first_line:self.line_index + 1] += sums.reshape(span, len(names), BINS_PER_DAY).astype(np.int64)
+
+    def result(self):
+        # the cage names and a days x cages x BINS_PER_DAY copy of the bins
+        counts = self.counts[:self.line_index + 1].copy()
+
+        # the first day starts with the log, so its bins are moved to the end
+        # of the row to finish at midnight like the days that follow it
+        # (unless it has been trimmed away)
+        if self.dropped == 0 and len(counts) > 1:
+            counts[0] = np.roll(counts[0], BINS_PER_DAY - self.first_bins, axis=1)
+        elif self.dropped == 0 and len(counts) == 1:
+            counts[0] = np.roll(counts[0], self.start // TIME_BIN, axis=1)
+
+        return self.names, counts
+
+    def open_bin(self):
+        # column of the bin being filled on the last row of result()
+        if self.line_index == 0 and self.dropped == 0:
+            return self.start // TIME_BIN + self.position_index
+        return self.position_index
+
+    def trim(self, days):
+        # keeps only the last days rows of bins, so that a binner following
+        # a log for weeks stays the same size
+        drop = self.line_index + 1 - days
+        if drop > 0:
+            self.counts = self.counts[drop:self.line_index + 1].copy()
+            self.line_index -= drop
+            self.dropped += drop
+
+def bin_log(filename, binner=None, final=True, progress=None):
+    # bins filename, carrying on from binner when it was saved from an
+    # earlier read of the same log
+    if binner is None or not binner.matches(filename):
+        binner = LogBinner()
+    return binner.read(filename, final, progress)
+
+def ordered(pool, function, items, ahead):
+    # results of function(*item) for every item in order, computed in pool
+    # with at most ahead calls submitted at a time to bound the memory
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, *item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+class Cancelled(Exception):
+    # a conversion stopped through its cancel event
+    pass
+
+def send_progress(queue, stop, filename, offset, lines):
+    # progress callback of the logs binned by bin_logs, which may be
+    # running in another process
+    if stop.is_set():
+        raise Cancelled(filename)
+    queue.put((filename, offset, lines))
+
+def bin_logs(ins, binners, final, workers, progress=None, cancel=None, task=bin_log):
+    # bins every log of ins in up to workers processes. With progress, it
+    # is called from this thread with the bytes binned, the bytes of all the
+    # logs and the lines binned as the workers go. Setting the cancel event
+    # stops every log after its current block and raises Cancelled. task
+    # stands in for bin_log, to wrap it with measured.
+    if progress is None and cancel is None:
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                return list(pool.map(task, ins, binners, final))
+        return list(map(task, ins, binners, final))
+
+    total = sum(path.getsize(i) for i in ins)
+    offsets = dict.fromkeys(ins, 0)
+    lines = dict.fromkeys(ins, 0)
+    # worker processes only see the queue and event of a manager, a single
+    # worker bins in a thread so that this one is free to report
+    with (Manager() if workers > 1 else nullcontext()) as manager, \
+            (ProcessPoolExecutor(workers) if workers > 1 else ThreadPoolExecutor(1)) as pool:
+        queue = manager.Queue() if manager else SimpleQueue()
+        stop = manager.Event() if manager else Event()
+        futures = [pool.submit(task, i, b, f, partial(send_progress, queue, stop))
+                   for i, b, f in zip(ins, binners, final)]
+        done = False
+        while not done:
+            done = not wait(futures, timeout=0.2).not_done
+            if cancel is not None and cancel.is_set():
+                stop.set()
+            try:
+                while True:
+                    filename, offsets[filename], lines[filename] = queue.get_nowait()
+            except Empty:
+                pass
+            if progress is not None:
+                progress(sum(offsets.values()), total, sum(lines.values()))
+        return [future.result() for future in futures]
+
+def rack_cage(cage, rack):
+    # cages of every rack after the first are told apart by the rack
+    # number, so the second rack keeps the "_2" suffix it always had
+    if rack == 0:
+        return cage
+    return cage + "_" + str(rack + 1)
+
+def bin_mapped(ins, binners, final, workers, progress=None, cancel=None, profiler=None):
+    # bins the logs one after the other through memory maps, every log
+    # being split in chunks scanned by up to workers processes, which keeps
+    # all the cores busy on a single huge log. progress and cancel work as
+    # in bin_logs.
+    total = sum(path.getsize(i) for i in ins)
+    # bytes and lines of the logs already binned, lines being reported as a
+    # running total over all the logs like bin_logs does
+    done = 0
+    lines_done = 0
+
+    def report(filename, offset, lines):
+        if cancel is not None and cancel.is_set():
+            raise Cancelled(filename)
+        if progress is not None:
+            progress(done + offset, total, lines_done + lines)
+
+    with (ProcessPoolExecutor(workers) if workers > 1 else nullcontext()) as pool:
+        for n, i in enumerate(ins):
+            if binners[n] is None or not binners[n].matches(i):
+                binners[n] = LogBinner()
+            with timed(profiler, "parse", i) as record:
+                binners[n].read_mapped(i, final[n], report, pool, 2 * workers)
+                record["rows"] = binners[n].lines_read
+                record["bytes"] = binners[n].bytes_read
+            done += path.getsize(i)
+            lines_done += binners[n].lines_read
+    return binners
+
+def parse_file(ins, workers=None, checkpoint=None, progress=None, cancel=None, profiler=None, mapped=0):
+    # ins holds one log per rack, the logs are binned in parallel by up to
+    # workers processes (all cores by default) and merged into one table.
+    # With a checkpoint file, only the lines added to each log since the
+    # last run are binned, and the bin state is saved again for the next.
+    # progress and cancel are handed to bin_logs, and every log is timed
+    # into profiler when there is one. mapped bins with bin_mapped instead.
+
+    if isinstance(ins, str):
+        ins = [ins]
+    if len(ins) > 1:
+        print(str(len(ins)) + " files were opened...")
+
+    # structure of data will be as follows, every cage holds a
+    # days x BINS_PER_DAY array with a row for each line of the CSV :
+    """
+    cages: {
+        "1": array([
+            [value1, value2, ...],
+            [value3, value4, ...]
+        ]),
+        "2": array([
+            [value5, value6, ...],
+            [value7, value8, ...]
+        ])
+    }
+    """
+
+    binners = [None] * len(ins)
+    if checkpoint is not None and path.exists(checkpoint):
+        with open(checkpoint, "rb") as f:
+            saved = pickle.load(f)
+        binners = [saved.get(path.abspath(i)) for i in ins]
+    # a log that is still being written may end in half a line
+    final = [checkpoint is None] * len(ins)
+
+    if mapped == 1:
+        binners = bin_mapped(ins, binners, final, workers or cpu_count() or 1, progress, cancel, profiler)
+    else:
+        workers = min(len(ins), workers or cpu_count() or 1)
+        if profiler is None:
+            binners = bin_logs(ins, binners, final, workers, progress, cancel)
+        else:
+            binners, measures = zip(*bin_logs(ins, binners, final, workers, progress, cancel, partial(measured, bin_log)))
+            for i, binner, measure in zip(ins, binners, measures):
+                profiler.add("parse", i, binner.lines_read, bytes=binner.bytes_read, **measure)
+
+    if checkpoint is not None:
+        # written aside first so that an interrupted run keeps the old one
+        with open(checkpoint + ".tmp", "wb") as f:
+            pickle.dump({path.abspath(i): binner for i, binner in zip(ins, binners)}, f)
+        replace(checkpoint + ".tmp", checkpoint)
+
+    cages = {}
+
+    for rack, binner in enumerate(binners):
+        names, counts = binner.result()
+        if len(names) == 0:
+            print("File is empty.")
+
+        for cage, column in names.items():
+            cages[rack_cage(cage, rack)] = counts[:, column]
+
+    return cages
+
+def write_cages(cages, out):
+    # iterate over every cage
+    for cage in cages:
+        # create csv, one line per day
+        cage_filepath = path.join(out, "Cage_" + cage + ".csv")
+        np.savetxt(cage_filepath, cages[cage], fmt="%d", delimiter=", ")
+
+def write_cages_column(cages, out):
+    # iterate over every cage
+    for cage in cages:
+        # create csv, one value per line
+        cage_filepath = path.join(out, "Cage_" + cage + "_single_column.csv")
+        np.savetxt(cage_filepath, cages[cage].ravel(), fmt="%d")
+
+def light_cycle(schedule):
+    # lights on and lights off hours of a schedule, 0 and 1 are the 6h-18h
+    # and 7h-19h schedules and any other (on, off) pair is used as it is
+    if schedule in SCHEDULES:
+        return SCHEDULES[schedule]
+    return schedule
+
+def label_columns(df, labels, first="Cage"):
+    # puts the label columns in front of df, the cage and then the ones
+    # left for the user to fill in
+    for column in ["Treatment","Condition","Gender","ID"]:
+        df.insert(0, column, "")
+    df.insert(0, first, labels)
+    return df
+
+def adjust_days(cages, out, schedule=0, raw=0, constant_memory=0):
+
+    # bins of lights on and off, the dark phase runs from lights off to the
+    # next lights on
+    on, off = (round(hour*3600/TIME_BIN) % BINS_PER_DAY for hour in light_cycle(schedule))
+    length = (on - off) % BINS_PER_DAY
+    if length == 0:
+        raise ValueError("The lights go on and off at the same time")
+    # bin of the first lights off after the first lights on of the log
+    shift = on + (off - on) % BINS_PER_DAY
+    header = ["%02d:%02d" % (divmod((off + i) % BINS_PER_DAY * TIME_BIN // 60, 60)) + "h" for i in range(length)]
+
+    adjusted = []
+    adjus_sum_raw = []
+    for cage in sorted(cages):
+        counts = cages[cage]
+        days = len(counts)
+
+        # every day of bins is moved so that its row starts at lights off,
+        # the dark phase is then the first length columns of each row
+        values = np.full((days + 2) * BINS_PER_DAY, np.nan)
+        values[:counts.size] = counts.ravel()
+        nights = values[shift:shift + days * BINS_PER_DAY].reshape(days, BINS_PER_DAY)[:, :length]
+
+        # the last dark phase may be cut short by the end of the log, it is
+        # shown but left out of the sums
+        starts = shift + np.arange(days) * BINS_PER_DAY
+        nights = nights[starts < counts.size]
+        complete = nights[(starts + length <= counts.size)[:len(nights)]]
+
+        data = pd.DataFrame(nights, columns=header)
+        data.insert(0, "Day", ["Day " + str(i) for i in range(len(nights))])
+        adjusted.append(label_columns(data, "Cage_" + cage))
+        adjus_sum_raw.append(complete.sum(axis=1).astype(np.int64).tolist())
+
+    adjus_sum_raw = pd.DataFrame(adjus_sum_raw)
+    adjus_sum_raw.columns = ["Day " + str(i) for i in range(adjus_sum_raw.shape[1])]
+    adjus_sum = label_columns(adjus_sum_raw*KM_PER_TURN, ["Cage_" + cage for cage in sorted(cages)])
+    label_columns(adjus_sum_raw, ["Cage_" + cage for cage in sorted(cages)])
+
+    sheets = [("Data", pd.concat(adjusted, ignore_index=True)), ("Sums Kms", adjus_sum)] + [("Sums Raw", adjus_sum_raw)] * raw
+    write_workbook(path.join(out, "Final Adjusted.xlsx"), sheets, constant_memory == 1, width=12.67)
+
+
+def join_files(cages, out, raw=0, adjusted_only=1, constant_memory=0):
+
+    if path.exists(path.join(out, "Final Data.xlsx")):
+        remove(path.join(out, "Final Data.xlsx"))
+
+    if adjusted_only == 0:
+
+        order = sorted(cages)
+        labels = ["Cage_" + cage for cage in order]
+
+        # every time bin of every cage, one row per day
+        data = pd.DataFrame(np.concatenate([cages[cage] for cage in order]),
+                            columns=["%02d:%02d" % (divmod(i*TIME_BIN//60, 60))+"h" for i in range(BINS_PER_DAY)])
+        label_columns(data, np.repeat(labels, [len(cages[cage]) for cage in order]), "Cage ID")
+
+        # day sums are reductions over the rows of the cage arrays
+        daysums = pd.DataFrame([cages[cage].sum(axis=1) for cage in order])
+        daysums.columns = ["Day " + str(i) for i in range(daysums.shape[1])]
+        daysums["Total"] = daysums.sum(axis=1)
+        daysums_conv = label_columns(daysums*KM_PER_TURN, labels, "Cage ID")
+        label_columns(daysums, labels, "Cage ID")
+
+        sheets = [("Data", data)] + [("Sums Raw", daysums)] * raw + [("Sums Kms", daysums_conv)]
+        write_workbook(path.join(out, "Final Data.xlsx"), sheets, constant_memory == 1, width=12.67)
+
+
+def write_columnar(cages, out, format="parquet"):
+    # Writes every bin of every cage, and the day sums, as tables with typed
+    # columns keyed by cage and day. The format is "parquet" or "arrow" (the
+    # Arrow IPC / Feather file format); both go through pyarrow.
+    order = sorted(cages)
+    days = np.array([len(cages[cage]) for cage in order])
+    bins = pd.DataFrame({
+        "cage": pd.Categorical(np.repeat(order, days * BINS_PER_DAY), categories=order),
+        "day": np.concatenate([np.repeat(np.arange(n, dtype=np.int32), BINS_PER_DAY) for n in days]),
+        "bin": np.tile(np.arange(BINS_PER_DAY, dtype=np.int16), days.sum()),
+        "turns": np.concatenate([cages[cage].ravel() for cage in order]),
+    })
+    sums = pd.DataFrame({
+        "cage": pd.Categorical(np.repeat(order, days), categories=order),
+        "day": np.concatenate([np.arange(n, dtype=np.int32) for n in days]),
+        "turns": np.concatenate([cages[cage].sum(axis=1) for cage in order]),
+    })
+    sums["km"] = sums["turns"]*KM_PER_TURN
+
+    extension = COLUMNAR_FORMATS[format]
+    for table, name in ((bins, COLUMNAR_BINS), (sums, COLUMNAR_SUMS)):
+        if format == "parquet":
+            table.to_parquet(path.join(out, name + extension), index=False)
+        else:
+            table.to_feather(path.join(out, name + extension))
+
+def read_columnar(filename):
+    # reads the bins written by write_columnar back into cages
+    if filename.endswith(COLUMNAR_FORMATS["parquet"]):
+        bins = pd.read_parquet(filename)
+    else:
+        bins = pd.read_feather(filename)
+    cages = {}
+    for cage, rows in bins.groupby("cage", observed=True, sort=False):
+        counts = np.zeros((rows["day"].max() + 1, BINS_PER_DAY), dtype=np.int64)
+        counts[rows["day"], rows["bin"]] = rows["turns"]
+        cages[str(cage)] = counts
+    return cages
+
+def export_excel(cages, out, schedule=0, raw=0, adjusted_only=1, report=print, profiler=None, constant_memory=0):
+    # the Excel workbooks, which can also be made later on from the
+    # columnar files with read_columnar. constant_memory streams them to
+    # disk row by row, without Excel tables.
+    rows = sum(len(counts) for counts in cages.values())
+    report("Joining files...")
+    with timed(profiler, "join", rows=rows):
+        join_files(cages, out, raw, adjusted_only, constant_memory)
+    report("Adjusting for schedule...")
+    with timed(profiler, "adjust", rows=rows):
+        adjust_days(cages, out, schedule, raw, constant_memory)
+
+def convert(ins, out, schedule=0, raw=0, adjusted_only=1, single_column=0, daily_csv=0, workers=None,
+            incremental=0, excel=1, columnar=None, report=print, progress=None, cancel=None, profiler=None,
+            mapped=0, constant_memory=0):
+    # runs the whole conversion of the logs in ins, one per rack, report is
+    # called with the name of each stage as it starts. An incremental run
+    # keeps a checkpoint in out and only parses what was appended since.
+    # columnar names the format of the optional columnar output. progress
+    # follows the parsing and cancel stops it, as in bin_logs; once the
+    # logs are parsed, cancel is checked between stages. Every stage is
+    # timed into profiler when there is one, rows being the lines parsed
+    # and then the days of bins of all the cages. mapped reads the logs
+    # through memory maps, as in parse_file, and constant_memory writes
+    # the workbooks as in export_excel.
+    def stage(text):
+        if cancel is not None and cancel.is_set():
+            raise Cancelled(text)
+        report(text)
+
+    report("Parsing...")
+    checkpoint = path.join(out, CHECKPOINT) if incremental == 1 else None
+    with timed(profiler, "parse"):
+        cages = parse_file(ins, workers, checkpoint, progress, cancel, profiler, mapped)
+    rows = sum(len(counts) for counts in cages.values())
+    # the per cage .csv files are only written when asked for, the
+    # joining and schedule stages read the parsed cages directly
+    if daily_csv == 1:
+        stage("Writing with lines...")
+        with timed(profiler, "daily csv", rows=rows):
+            write_cages(cages, out)
+    if single_column == 1:
+        stage("Writing in a column...")
+        with timed(profiler, "column csv", rows=rows):
+            write_cages_column(cages, out)
+    if columnar is not None:
+        stage("Writing columnar files...")
+        with timed(profiler, "columnar", rows=rows):
+            write_columnar(cages, out, columnar)
+    if excel == 1:
+        export_excel(cages, out, schedule, raw, adjusted_only, stage, profiler, constant_memory)
+    report("Finished and wrote to files!")
+    return cages
+
+def summarize(binners, idle=10):
+    # one row per cage with the turns of the bin being filled, of the last
+    # idle bins and of the day so far, the km of the day so far and the
+    # minutes since the wheel last turned, within the window of the binners
+    rows = []
+    for rack, binner in enumerate(binners):
+        names, counts = binner.result()
+        if len(counts) == 0:
+            continue
+        # bins of every cage up to the one being filled, oldest first
+        column = binner.open_bin()
+        series = counts.transpose(1, 0, 2).reshape(len(names), -1)[:, :(len(counts) - 1) * BINS_PER_DAY + column + 1]
+        today = counts[-1, :, :column + 1].sum(axis=1)
+        turning = series > 0
+        still = np.where(turning.any(axis=1), np.argmax(turning[:, ::-1], axis=1), series.shape[1])
+        for cage, c in names.items():
+            rows.append([rack_cage(cage, rack), series[c, -1], series[c, -idle:].sum(), today[c],
+                         today[c]*KM_PER_TURN, still[c]*TIME_BIN//60])
+    return pd.DataFrame(rows, columns=["Cage", "Last bin", "Last %d bins" % idle, "Today", "Today km", "Idle min"])
+
+def watch(ins, interval=60, window=2, idle=10, report=print):
+    # Follows logs that are still being written, like tail -f, binning the
+    # lines added every interval seconds and reporting the summary of every
+    # cage. Only the last window days of bins are kept. Cages that have not
+    # turned for idle bins are marked, as their wheel may be stuck.
+    # Runs until interrupted.
+    if isinstance(ins, str):
+        ins = [ins]
+    binners = [None] * len(ins)
+    try:
+        while True:
+            binners = [bin_log(i, binner, final=False) for i, binner in zip(ins, binners)]
+            for binner in binners:
+                binner.trim(window)
+            summary = summarize(binners, idle)
+            summary[""] = np.where(summary["Idle min"] >= idle*TIME_BIN//60, "!", "")
+            report(strftime("%Y-%m-%d %H:%M:%S") + "\n" + summary.to_string(index=False))
+            sleep(interval)
+    except KeyboardInterrupt:
+        return binners
+
+def parse_schedule(text):
+    # "ON-OFF" hours of the --schedule option, halves like 6.5-18.5 are fine
+    # as long as they fall on a time bin
+    on, off = (float(hour) for hour in text.split("-"))
+    if (on*3600) % TIME_BIN or (off*3600) % TIME_BIN or on % 24 == off % 24:
+        raise ValueError(text)
+    return on, off
+
+def main(argv=None):
+    parser = ArgumentParser(description="Convert running wheel logs to binned Excel workbooks without the GUI. "
+                                        "Run one process per room to convert many rooms in parallel.")
+    parser.add_argument("logs", nargs="+", help="running wheel .txt logs, one per rack, or a columnar bins file "
+                                                "written earlier to make its Excel workbooks")
+    parser.add_argument("-o", "--out", default=".", help="output directory (default: current directory)")
+    parser.add_argument("--schedule", type=parse_schedule, default="6-18",
+                        help="lights on and lights off hours, like 7-19 or 20-8 for a reversed cycle (default: 6-18)")
+    parser.add_argument("--raw", action="store_true", help="include raw wheel turns")
+    parser.add_argument("--all-bins", action="store_true", help="also write Final Data.xlsx with every time bin")
+    parser.add_argument("--single-column", action="store_true", help="include individual single column .csv")
+    parser.add_argument("--daily-csv", action="store_true", help="include individual daily .csv")
+    parser.add_argument("--workers", type=int, help="processes used to parse the logs (default: one per core)")
+    parser.add_argument("--mmap", action="store_true",
+                        help="read the logs through memory maps and split every log across the workers, "
+                             "for a few very large logs")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only parse lines appended since the last incremental run into the same output directory")
+    parser.add_argument("--watch", type=int, metavar="SECONDS",
+                        help="follow the logs as they are written and print a summary of every cage every SECONDS")
+    parser.add_argument("--window", type=int, default=2, help="days of bins kept while watching (default: 2)")
+    parser.add_argument("--columnar", choices=sorted(COLUMNAR_FORMATS),
+                        help="also write the bins and day sums as Parquet or Arrow files")
+    parser.add_argument("--no-excel", action="store_true", help="do not write the Excel workbooks")
+    parser.add_argument("--constant-memory", action="store_true",
+                        help="stream the Excel workbooks to disk row by row, with filters instead of tables")
+    parser.add_argument("--timings", action="store_true",
+                        help="write the time, memory and rows of every stage and log to " + TIMINGS)
+    parser.add_argument("--profile", action="store_true", help="also profile the run with cProfile into " + PROFILE)
+    args = parser.parse_args(argv)
+
+    if args.watch:
+        watch(args.logs, args.watch, args.window)
+        return
+
+    profiler = None
+    if args.timings or args.profile:
+        profiler = Profiler(path.join(args.out, PROFILE) if args.profile else None)
+
+    if args.logs[0].endswith(tuple(COLUMNAR_FORMATS.values())):
+        export_excel(read_columnar(args.logs[0]), args.out, schedule=args.schedule,
+                     raw=int(args.raw), adjusted_only=int(not args.all_bins), profiler=profiler,
+                     constant_memory=int(args.constant_memory))
+    else:
+        convert(args.logs, args.out, schedule=args.schedule, raw=int(args.raw),
+                adjusted_only=int(not args.all_bins), single_column=int(args.single_column),
+                daily_csv=int(args.daily_csv), workers=args.workers, incremental=int(args.incremental),
+                excel=int(not args.no_excel), columnar=args.columnar, profiler=profiler, mapped=int(args.mmap),
+                constant_memory=int(args.constant_memory))
+
+    if profiler is not None:
+        profiler.write(path.join(args.out, TIMINGS))
+        print(profiler.summary())
+
+if __name__ == "__main__":
+    main()
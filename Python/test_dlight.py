@@ -0,0 +1,66 @@
+import warnings
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+from dlight import read_seconds, stream_seconds, treat, treated_name
+
+# timestamp of the recordings
+STAMP = 0.5
+
+
+def recording(tmp_path, values):
+    # a 'df_F.csv' recording of values sampled at 100 Hz
+    filename = str(tmp_path / "test - df_F.csv")
+    pd.DataFrame({"Time": np.arange(len(values)) / 100.0, "dF/F": values}).to_csv(filename, header=False, index=False)
+    return filename
+
+def assert_same_seconds(filename, chunk_rows):
+    # chunked mode gives the seconds of the whole recording read at once
+    exact, rows = read_seconds(filename, STAMP)
+    streamed, streamed_rows = stream_seconds(filename, STAMP, chunk_rows=chunk_rows, sample_size=16)
+    assert streamed_rows == rows
+    np.testing.assert_array_equal(streamed["Time"], exact["Time"])
+    np.testing.assert_allclose(streamed["Average 1"], exact["Average 1"], rtol=1e-9, atol=1e-9)
+
+@pytest.mark.parametrize("spike", [1e4, 1e6, np.inf, -np.inf, np.nan])
+@pytest.mark.parametrize("chunk_rows", [7, 1000])
+def test_spike(tmp_path, spike, chunk_rows):
+    values = np.random.default_rng(0).normal(0, 0.1, 3000)
+    values[1000] = spike
+    assert_same_seconds(recording(tmp_path, values), chunk_rows)
+
+def test_both_infinities(tmp_path):
+    values = np.random.default_rng(0).normal(0, 0.1, 3000)
+    values[[1000, 1001, 2000]] = [np.inf, -np.inf, np.inf]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        assert_same_seconds(recording(tmp_path, values), 7)
+
+def test_all_nan(tmp_path):
+    filename = recording(tmp_path, np.full(300, np.nan))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        assert_same_seconds(filename, 7)
+
+@pytest.mark.parametrize("chunk_rows", [None, 7])
+@pytest.mark.parametrize("constant_memory", [False, True])
+@pytest.mark.parametrize("mad", ["spike", "zero"])
+def test_treat_infinities(tmp_path, chunk_rows, constant_memory, mad):
+    # infinite averages, from an infinite sample or a MAD of 0 that makes
+    # every z-score infinite or NaN, reach the treated workbook as text
+    if mad == "spike":
+        values = np.random.default_rng(0).normal(0, 0.1, 3000)
+        values[1000] = np.inf
+    else:
+        values = np.where(np.arange(3000) % 7 == 0, 1.0, 0.0)
+    filename = recording(tmp_path, values)
+    treated = treated_name(filename, str(tmp_path))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        averages = treat(filename, STAMP, treated, [1, 5, 10], constant_memory=constant_memory, chunk_rows=chunk_rows)[0]
+    sheet = list(openpyxl.load_workbook(treated)["dF_F Averages"].values)
+    column = [row[sheet[0].index("Average 1")] for row in sheet[1:]]
+    assert len(column) == len(averages[1])
+    assert [value == "inf" for value in column] == list(averages[1] == np.inf)
+    assert "inf" in column
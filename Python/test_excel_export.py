@@ -0,0 +1,15 @@
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+from excel_export import write_workbook
+
+
+@pytest.mark.parametrize("constant_memory", [False, True])
+def test_infinite_values(tmp_path, constant_memory):
+    # infinities are written as text like to_excel, missing values blank
+    filename = str(tmp_path / "inf.xlsx")
+    df = pd.DataFrame({"Time": [1.0, 2.0, 3.0, 4.0], "Average 1": [0.5, np.inf, -np.inf, np.nan]})
+    write_workbook(filename, [("dF_F Averages", df)], constant_memory)
+    rows = list(openpyxl.load_workbook(filename)["dF_F Averages"].values)
+    assert rows == [("Time", "Average 1"), (1, 0.5), (2, "inf"), (3, "-inf"), (4, None)]
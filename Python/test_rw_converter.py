@@ -0,0 +1,154 @@
+import random
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+import rw_converter
+from rw_converter import BINS_PER_DAY, TIME_BIN, decode_timestamps, line_pattern, parse_file, scan, scan_layout
+
+# wall-clock microseconds of a line are counted from this day
+EPOCH = datetime(1970, 1, 1)
+
+
+def write_log(filename, days=3, cages=3, gap=0.02, seed=0):
+    # a log of readings every 30 seconds or so, with a gap of up to a few
+    # hours after about one reading in 1/gap
+    rng = random.Random(seed)
+    time = datetime(2023, 5, 1, 13, 37, 12)
+    end = time.replace(hour=0, minute=0, second=0) + timedelta(days=days, hours=-5)
+    with open(filename, "w") as f:
+        while time < end:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            for cage in range(1, cages + 1):
+                f.write('"%s:%03d", Cage %d: %d\n' % (stamp, rng.randint(0, 999), cage, rng.randint(0, 20)))
+            time += timedelta(seconds=30 + rng.randint(-2, 2))
+            if rng.random() < gap:
+                time += timedelta(seconds=rng.randint(TIME_BIN, 4 * 3600))
+
+def write_lines(rng, lines=50, digits=3, names=("1", "2"), newline="\n", trailing="", blank=0.0, final=True,
+                decimal=False, spaces=(1,)):
+    # bytes of a log of lines with fractions of the given digits, cages of
+    # the given names, trailing after the readings and a blank line after
+    # about one line in 1/blank, ending with a newline if final. Every gap
+    # of the line takes one of the numbers of spaces, but the one before
+    # the colon which takes one less.
+    time = datetime(rng.randint(1999, 2030), rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23))
+    text = []
+    for _ in range(lines):
+        reading = "%d.%d" % (rng.randint(0, 99), rng.randint(0, 9)) if decimal else str(rng.randint(0, 10 ** rng.randint(1, 6)))
+        fraction = str(rng.randint(0, 10 ** digits - 1)).zfill(digits)
+        gaps = [" " * rng.choice(spaces) for _ in range(4)]
+        text.append('"%s:%s",%sCage%s%s%s:%s%s%s' % (time.strftime("%Y-%m-%d %H:%M:%S"), fraction, gaps[0], gaps[1],
+                                                     rng.choice(names), gaps[2][1:], gaps[3], reading, trailing))
+        if rng.random() < blank:
+            text.append("")
+        time += timedelta(seconds=rng.randint(0, 40000))
+    return (newline.join(text) + (newline if final else "")).encode()
+
+def regex_scan(buffer):
+    # scan of buffer by the regex, which takes every line it can match
+    fields = np.array(line_pattern.findall(buffer))
+    day_number, time_of_day = decode_timestamps(fields)
+    return day_number, time_of_day, fields[:, 5], fields[:, 6].astype(np.int64)
+
+def assert_same_scan(buffer, layout=True):
+    # scan gives what the regex does, straight from the bytes if layout
+    if layout:
+        assert scan_layout(buffer, 0, len(buffer)) is not None
+    for scanned, expected in zip(scan(buffer), regex_scan(buffer)):
+        assert scanned.tolist() == expected.tolist()
+
+def reference_bins(filename):
+    # The per-line loop the binning engine replaced: a line opens a new bin
+    # when it is at least TIME_BIN past the start of the current one, only
+    # one bin per line, and a new day starts again from its first line.
+    # Returns the cages with a days x BINS_PER_DAY array each, laid out as
+    # parse_file does, the first day ending at midnight.
+    days, lengths, names = [], [], []
+    day = None
+    with open(filename, "rb") as f:
+        for line in f:
+            fields = line_pattern.match(line)
+            if fields is None:
+                continue
+            date, hours, minutes, seconds, fraction, cage, reading = fields.groups()
+            stamp = b"%s %s:%s:%s:%s" % (date, hours, minutes, seconds, fraction)
+            time = (datetime.strptime(stamp.decode(), "%Y-%m-%d %H:%M:%S:%f") - EPOCH) // timedelta(microseconds=1)
+            if date != day:
+                day, base, position = date, time, 0
+                days.append({})
+                lengths.append(0)
+                if len(days) == 1:
+                    start = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+            elif base + TIME_BIN * 1000000 <= time:
+                position += 1
+                base += TIME_BIN * 1000000
+            cage = cage.decode()
+            if cage not in names:
+                names.append(cage)
+            bins = days[-1].setdefault(cage, {})
+            bins[position] = bins.get(position, 0) + int(reading)
+            lengths[-1] = position + 1
+
+    cages = {cage: np.zeros((len(days), BINS_PER_DAY), dtype=np.int64) for cage in names}
+    for row, bins in enumerate(days):
+        shift = 0
+        if row == 0:
+            shift = start // TIME_BIN if len(days) == 1 else BINS_PER_DAY - lengths[0]
+        for cage in names:
+            for position, reading in bins.get(cage, {}).items():
+                cages[cage][row, shift + position] += reading
+    return cages
+
+def assert_same_bins(cages, expected):
+    assert list(cages) == list(expected)
+    for cage in expected:
+        np.testing.assert_array_equal(cages[cage], expected[cage])
+
+@pytest.mark.parametrize("chunk_size", [1 << 22, 4096, 300])
+def test_bins_match_line_loop(tmp_path, monkeypatch, chunk_size):
+    # blocks of the log carry the bin state over to the next
+    log = str(tmp_path / "rack.txt")
+    write_log(log)
+    monkeypatch.setattr(rw_converter, "CHUNK_SIZE", chunk_size)
+    assert_same_bins(parse_file(log, workers=1), reference_bins(log))
+
+def test_appended_lines_match_line_loop(tmp_path, monkeypatch):
+    # a log read with a checkpoint, then read again with the lines added
+    # since, is binned as when read in one go
+    full = str(tmp_path / "full.txt")
+    write_log(full, seed=1)
+    with open(full, "rb") as f:
+        lines = f.readlines()
+    log = str(tmp_path / "rack.txt")
+    checkpoint = str(tmp_path / rw_converter.CHECKPOINT)
+    monkeypatch.setattr(rw_converter, "CHUNK_SIZE", 4096)
+    for end in [len(lines) // 3, 2 * len(lines) // 3 + 1, len(lines)]:
+        with open(log, "wb") as f:
+            f.writelines(lines[:end])
+        cages = parse_file(log, workers=1, checkpoint=checkpoint)
+    assert_same_bins(cages, reference_bins(full))
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+@pytest.mark.parametrize("trailing", ["", "  "])
+@pytest.mark.parametrize("digits", [1, 2, 3, 4, 5, 6])
+def test_scan_layout(newline, trailing, digits):
+    assert_same_scan(write_lines(random.Random(digits), digits=digits, newline=newline, trailing=trailing))
+
+def test_scan_cage_names_with_spaces():
+    assert_same_scan(write_lines(random.Random(0), names=("A 1", "Rack 2 B", "12"), spaces=(0, 1, 3)))
+
+@pytest.mark.parametrize("final", [True, False])
+def test_scan_blank_lines(final):
+    assert_same_scan(write_lines(random.Random(0), blank=0.2, final=final, newline="\r\n"))
+
+def test_scan_decimal_readings():
+    # readings with decimals are left to the regex, which keeps the units
+    assert_same_scan(write_lines(random.Random(0), decimal=True), layout=False)
+
+@pytest.mark.parametrize("seed", range(50))
+def test_scan_mixed(seed):
+    rng = random.Random(seed)
+    decimal = rng.random() < 0.2
+    assert_same_scan(write_lines(rng, rng.randint(1, 200), rng.randint(1, 6), rng.choice([("1", "2"), ("A 1", "B")]),
+                                 rng.choice(["\n", "\r\n"]), rng.choice(["", " ", "   "]), rng.random() / 4,
+                                 rng.random() < 0.5, decimal, (0, 1, 2)), layout=not decimal)
@@ -0,0 +1,103 @@
+import hashlib
+from functools import partial
+from os import listdir, makedirs, path, remove, replace, stat, utime, getpid
+import numpy as np
+import pandas as pd
+
+# bytes of parsed traces kept in a cache before the least recently used go
+CACHE_SIZE = 1 << 30
+# bytes hashed at a time
+HASH_BLOCK = 1 << 20
+
+
+def file_hash(filename):
+    # hash of the contents of filename, read a block at a time
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as f:
+        for block in iter(partial(f.read, HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(filename, name=""):
+    # key of the trace read from filename by the reader called name: its
+    # path, size, modification time and contents, so a file that is
+    # changed, replaced or copied over with the same time is read again
+    info = stat(filename)
+    text = "%s|%d|%d|%s|%s" % (path.abspath(filename), info.st_size, info.st_mtime_ns, file_hash(filename), name)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def evict(cache, limit=CACHE_SIZE):
+    # Removes the least recently used traces until the cache holds at most
+    # limit bytes. Every use of a trace touches its file, so the oldest
+    # modification times go first. Other processes may be evicting too, or
+    # have a trace mapped, which Windows will not remove until the next time.
+    entries = []
+    for name in listdir(cache):
+        if name.endswith(".npy"):
+            try:
+                info = stat(path.join(cache, name))
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime_ns, info.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            remove(path.join(cache, name))
+        except OSError:
+            continue
+        total -= size
+
+def load(entry):
+    # the records of a cache entry, memory mapped, or None when there is no
+    # such entry; using an entry makes it the most recently used
+    try:
+        records = np.load(entry, mmap_mode="r")
+        utime(entry)
+    except (FileNotFoundError, ValueError):
+        return None
+    return records
+
+def lookup(filename, cache=None, name=""):
+    # the records kept in cache of the trace read from filename by the
+    # reader called name, or None when there are none
+    if cache is None:
+        return None
+    return load(path.join(cache, cache_key(filename, name) + ".npy"))
+
+def frame(records):
+    # DataFrame of records, or of a slice of them
+    return pd.DataFrame({field.encode("ascii").decode("unicode_escape"): np.array(records[field])
+                         for field in records.dtype.names})
+
+def cached(read, filename, cache=None, name="", limit=CACHE_SIZE):
+    # The DataFrame read(filename) returns, kept in the directory cache as
+    # a .npy file of records the first time, then loaded from it through a
+    # memory map without parsing the file again. name tells apart traces
+    # read from the same file in different ways. Traces with columns that
+    # are not numbers are not cached, nor is anything when cache is None.
+    if cache is None:
+        return read(filename)
+    entry = path.join(cache, cache_key(filename, name) + ".npy")
+    records = load(entry)
+    if records is not None:
+        df = frame(records)
+        del records
+        evict(cache, limit)
+        return df
+
+    df = read(filename)
+    if all(np.issubdtype(dtype, np.number) for dtype in df.dtypes):
+        makedirs(cache, exist_ok=True)
+        # written under another name first, so a crash or another process
+        # never finds half a trace
+        temporary = "%s.%d.tmp" % (entry, getpid())
+        records = df.to_records(index=False)
+        # field names are escaped to ASCII, like 'ΔF/F', for the .npy header
+        records.dtype.names = [str(column).encode("unicode_escape").decode("ascii") for column in df.columns]
+        with open(temporary, "wb") as f:
+            np.save(f, records, allow_pickle=False)
+        replace(temporary, entry)
+        evict(cache, limit)
+    return df